@@ -2,8 +2,15 @@
 import streamlit as st
 import requests
 import pandas as pd
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime, timedelta, timezone
+import asyncio
+import threading
 import time
+import aiohttp
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 st.set_page_config(page_title="코인 거래량 변화율 트래커", layout="wide")
 
@@ -12,108 +19,317 @@ UPBIT_TICKER_URL = "https://api.upbit.com/v1/ticker"
 UPBIT_MARKETS_URL = "https://api.upbit.com/v1/market/all"
 UPBIT_CANDLE_URL = "https://api.upbit.com/v1/candles/days"  # 일봉 데이터 URL
 
+# 업비트 API 호출 제한 (IP당 초당 10회)
+UPBIT_MAX_REQUESTS_PER_SEC = 10
+
+# 거래량 데이터 열 목록
+VOLUME_DATA_COLUMNS = ['exchange', 'market', 'korean_name', 'today_volume', 'yesterday_volume',
+                       'trade_price', 'signed_change_rate', 'volume_change_rate', 'abs_volume_change_rate',
+                       'timestamp']
+
+@st.cache_resource
+def get_http_session():
+    """마켓 목록 요청에 쓰는 재시도 설정된 HTTP 세션을 만듭니다. (현재가·일봉은 aiohttp 사용)"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+    ))
+    return session
+
+SESSION = get_http_session()
+
+@st.cache_data(ttl=60 * 60 * 24, show_spinner=False)
+def fetch_upbit_market_codes():
+    """업비트의 KRW 마켓 코드와 한글 이름을 가져옵니다. (하루 동안 캐시)"""
+    response = SESSION.get(UPBIT_MARKETS_URL)
+    response.raise_for_status()
+    markets = orjson.loads(response.content)
+    krw_markets = [market['market'] for market in markets if market['market'].startswith('KRW-')]
+    
+    # 한글 이름도 함께 가져오기
+    market_names = {market['market']: market.get('korean_name', market['market'].replace('KRW-', '')) 
+                   for market in markets if market['market'].startswith('KRW-')}
+    
+    return krw_markets, market_names
+
 def get_upbit_market_codes():
     """업비트의 모든 마켓 코드를 가져옵니다."""
     try:
-        response = requests.get(UPBIT_MARKETS_URL)
-        markets = response.json()
-        krw_markets = [market['market'] for market in markets if market['market'].startswith('KRW-')]
-        
-        # 한글 이름도 함께 가져오기
-        market_names = {market['market']: market.get('korean_name', market['market'].replace('KRW-', '')) 
-                       for market in markets if market['market'].startswith('KRW-')}
-        
-        return krw_markets, market_names
+        return fetch_upbit_market_codes()
     except Exception as e:
         st.error(f"업비트 마켓 코드 가져오기 오류: {e}")
         return [], {}
 
-def get_yesterday_volume(market):
-    """특정 마켓의 어제 거래량을 가져옵니다."""
-    try:
-        # 어제 날짜
-        yesterday = datetime.now() - timedelta(days=1)
-        yesterday_str = yesterday.strftime("%Y-%m-%d")
-        
-        params = {
-            "market": market,
-            "count": 2,  # 최근 2일치 데이터
-            "to": yesterday_str + " 23:59:59"  # 어제 마지막 시간
-        }
-        
-        response = requests.get(UPBIT_CANDLE_URL, params=params)
-        candles = response.json()
-        
-        if not candles or len(candles) < 1:
-            return 0
-        
-        # 첫 번째 캔들이 어제 거래량
-        return candles[0]['candle_acc_trade_volume']
-    except Exception as e:
-        st.warning(f"{market} 어제 거래량 가져오기 오류: {e}")
+async def fetch_upbit_tickers(market_codes):
+    """업비트의 현재가 정보를 비동기로 가져옵니다. 존재하지 않는 마켓이 있으면 None을 반환합니다."""
+    # 한 번에 최대 100개 마켓 정보만 요청 가능하므로 분할하여 동시에 요청
+    chunks = [market_codes[i:i+100] for i in range(0, len(market_codes), 100)]
+    
+    async def fetch(session, chunk):
+        params = {"markets": ",".join(chunk)}
+        async with session.get(UPBIT_TICKER_URL, params=params) as response:
+            if response.status == 404:  # 상장 폐지 등으로 사라진 마켓 코드
+                return None
+            response.raise_for_status()
+            return await response.json(loads=orjson.loads)
+    
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(fetch(session, chunk) for chunk in chunks))
+    
+    if any(tickers is None for tickers in results):
+        return None
+    
+    return [ticker for tickers in results for ticker in tickers]
+
+@st.cache_resource(ttl=60 * 60 * 24)
+def get_yesterday_volume_cache(date_key):
+    """날짜별 어제 거래량 캐시와 잠금을 만듭니다. (마감된 일봉은 바뀌지 않음, 세션 간 공유)"""
+    return threading.Lock(), {}
+
+@st.cache_resource
+def get_upbit_rate_limiter():
+    """모든 세션이 함께 쓰는 업비트 일봉 API 호출 간격 상태를 만듭니다. (호출 제한은 IP 단위)"""
+    return {"lock": threading.Lock(), "next_slot": 0.0}
+
+async def wait_for_upbit_slot(limiter):
+    """초당 호출 제한을 넘지 않도록 다음 호출 시각까지 기다립니다."""
+    with limiter["lock"]:
+        now = time.monotonic()
+        slot = max(now, limiter["next_slot"])
+        limiter["next_slot"] = slot + 1.0 / UPBIT_MAX_REQUESTS_PER_SEC
+    await asyncio.sleep(slot - now)
+
+async def fetch_yesterday_volume(session, limiter, market, yesterday_str):
+    """특정 마켓의 어제(UTC) 거래량을 비동기로 가져옵니다."""
+    params = {
+        "market": market,
+        "count": 2,  # 최근 2일치 데이터
+        "to": yesterday_str + "T23:59:59Z"  # 어제 마지막 시간 (UTC)
+    }
+    
+    await wait_for_upbit_slot(limiter)
+    async with session.get(UPBIT_CANDLE_URL, params=params) as response:
+        response.raise_for_status()
+        candles = await response.json(loads=orjson.loads)
+    
+    if not candles or len(candles) < 1:
+        return 0
+    
+    # 첫 번째 캔들이 어제 거래량 (어제 거래가 없었다면 그 이전 날짜의 캔들이 오므로 0)
+    candle = candles[0]
+    if candle['candle_date_time_utc'][:10] != yesterday_str:
         return 0
+    return candle['candle_acc_trade_volume']
+
+async def fetch_yesterday_volumes(markets, yesterday_str, progress_bar):
+    """여러 마켓의 어제 거래량을 동시에 가져옵니다."""
+    limiter = get_upbit_rate_limiter()
+    total = len(markets)
+    completed = 0
+    
+    async def fetch(session, market):
+        nonlocal completed
+        try:
+            return await fetch_yesterday_volume(session, limiter, market, yesterday_str)
+        finally:
+            # 진행 상황 업데이트 (브라우저로 보내는 메시지를 줄이기 위해 10개마다)
+            completed += 1
+            if completed % 10 == 0 or completed == total:
+                progress_bar.progress(completed / total, text=f"거래량 데이터 수집 중... ({completed}/{total})")
+    
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(fetch(session, market) for market in markets), return_exceptions=True)
+    
+    # 오류가 난 마켓은 결과에서 제외하여 다음 새로고침 때 다시 조회
+    fetched = {}
+    for market, result in zip(markets, results):
+        if isinstance(result, Exception):
+            st.warning(f"{market} 어제 거래량 가져오기 오류: {result}")
+            continue
+        fetched[market] = result
+    
+    return fetched
 
 def get_upbit_volume_data(market_codes, market_names):
     """업비트의 거래량 데이터를 가져옵니다."""
     try:
-        # 한 번에 최대 100개 마켓 정보만 요청 가능하므로 분할 요청
-        chunks = [market_codes[i:i+100] for i in range(0, len(market_codes), 100)]
-        all_tickers = []
+        all_tickers = asyncio.run(fetch_upbit_tickers(market_codes))
+        if all_tickers is None:
+            # 캐시된 마켓 목록이 오래되었으므로 새로 받아 다시 요청
+            fetch_upbit_market_codes.clear()
+            market_codes, market_names = get_upbit_market_codes()
+            all_tickers = asyncio.run(fetch_upbit_tickers(market_codes))
+            if all_tickers is None:
+                raise ValueError("존재하지 않는 마켓 코드가 포함되어 있습니다.")
         
-        for chunk in chunks:
-            params = {"markets": ",".join(chunk)}
-            response = requests.get(UPBIT_TICKER_URL, params=params)
-            tickers = response.json()
-            all_tickers.extend(tickers)
-            time.sleep(0.1)  # API 호출 제한 방지를 위한 딜레이
+        # 마켓 코드를 가져오지 못한 경우 빈 데이터 반환
+        if not all_tickers:
+            return pd.DataFrame(columns=VOLUME_DATA_COLUMNS)
         
-        volume_data = []
-        
-        with st.progress(0.0, text="거래량 데이터 수집 중..."):
-            total = len(all_tickers)
+        # 어제 거래량 조회 (캐시에 없는 마켓만 일봉 API를 동시에 호출)
+        # 업비트 일봉은 UTC 0시에 마감되므로 날짜도 UTC 기준으로 계산
+        yesterday_str = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+        cache_lock, volume_cache = get_yesterday_volume_cache(yesterday_str)
+        with cache_lock:
+            yesterday_volumes = dict(volume_cache)
+        missing_markets = [ticker.get('market', '') for ticker in all_tickers
+                           if ticker.get('market', '') not in yesterday_volumes]
+        if missing_markets:
+            progress_bar = st.progress(0.0, text="거래량 데이터 수집 중...")
+            fetched = asyncio.run(fetch_yesterday_volumes(missing_markets, yesterday_str, progress_bar))
+            yesterday_volumes.update(fetched)
             
-            for i, ticker in enumerate(all_tickers):
-                try:
-                    market = ticker.get('market', '')
-                    
-                    # 진행 상황 업데이트
-                    progress = (i + 1) / total
-                    st.progress(progress, text=f"거래량 데이터 수집 중... ({i+1}/{total})")
-                    
-                    # 현재 24시간 거래량 (소수점 제거)
-                    today_volume = int(ticker.get('acc_trade_volume_24h', 0))
-                    
-                    # 어제 거래량 조회 (일봉 API 사용, 소수점 제거)
-                    yesterday_volume = int(get_yesterday_volume(market))
-                    
-                    # 거래량 변화율 계산 (소수점 1자리 반올림)
-                    if yesterday_volume > 0:
-                        volume_change_rate = round(((today_volume - yesterday_volume) / yesterday_volume) * 100, 1)
-                    else:
-                        volume_change_rate = 0
-                    
-                    # 필요한 정보만 추출
-                    data = {
-                        'exchange': '업비트',
-                        'market': market,
-                        'korean_name': market_names.get(market, market.replace('KRW-', '')),
-                        'today_volume': today_volume,
-                        'yesterday_volume': yesterday_volume,
-                        'trade_price': ticker.get('trade_price', 0),
-                        'signed_change_rate': ticker.get('signed_change_rate', 0) * 100,  # 퍼센트로 변환
-                        'volume_change_rate': volume_change_rate,
-                        'timestamp': datetime.now()
-                    }
-                    
-                    volume_data.append(data)
-                except Exception as e:
-                    st.warning(f"업비트 {ticker.get('market', 'unknown')} 데이터 처리 오류: {e}")
-                    continue
+            # 어제(UTC) 일봉은 이미 마감되었으므로 그대로 캐시에 저장
+            with cache_lock:
+                volume_cache.update(fetched)
+        
+        tickers = pd.DataFrame(all_tickers)
+        markets = tickers['market']
         
-        return volume_data
+        # 현재 24시간 거래량과 어제 거래량 (소수점은 표시할 때만 제거)
+        today_volume = tickers['acc_trade_volume_24h'].fillna(0).to_numpy(dtype=np.float64)
+        yesterday_volume = markets.map(yesterday_volumes).fillna(0).to_numpy(dtype=np.float64)
+        
+        # 거래량 변화율 계산 (어제 거래량이 없으면 0, 소수점 1자리 반올림)
+        volume_change_rate = np.divide(
+            (today_volume - yesterday_volume) * 100.0, yesterday_volume,
+            out=np.zeros(len(tickers)), where=yesterday_volume > 0
+        ).round(1)
+        
+        # 필요한 정보만 추출
+        return pd.DataFrame({
+            'exchange': '업비트',
+            'market': markets,
+            'korean_name': markets.map(market_names).fillna(markets.str.removeprefix('KRW-')),
+            'today_volume': today_volume,
+            'yesterday_volume': yesterday_volume,
+            'trade_price': tickers['trade_price'],
+            'signed_change_rate': (tickers['signed_change_rate'] * 100).round(1),  # 퍼센트로 변환
+            'volume_change_rate': volume_change_rate,
+            'abs_volume_change_rate': np.abs(volume_change_rate),  # 필터와 정렬에 쓰는 절대값
+            'timestamp': pd.to_datetime(tickers['timestamp'], unit='ms', utc=True)  # 시세 조회 시각
+        })
     except Exception as e:
         st.error(f"업비트 거래량 데이터 가져오기 오류: {e}")
-        return []
+        return pd.DataFrame(columns=VOLUME_DATA_COLUMNS)
+
+@st.cache_data(ttl=60 * 60, max_entries=32, show_spinner=False)
+def build_view(volume_data, min_volume, min_change_rate, sort_by):
+    """필터 조건에 맞는 데이터를 선택한 기준으로 정렬합니다."""
+    # 데이터 필터링
+    filtered_data = volume_data[
+        (volume_data['today_volume'] >= min_volume)
+        & (volume_data['abs_volume_change_rate'] >= min_change_rate)
+    ]
+    
+    # 정렬 적용
+    if sort_by == "거래량 변화율 (절대값)":
+        return filtered_data.sort_values('abs_volume_change_rate', ascending=False, kind='stable')
+    elif sort_by == "거래량 변화율 (양수 우선)":
+        # 양수 먼저, 각 그룹 안에서는 절대값이 큰 순서
+        return (filtered_data.assign(_positive=filtered_data['volume_change_rate'] > 0)
+                .sort_values(['_positive', 'abs_volume_change_rate'], ascending=False, kind='stable'))
+    else:  # "오늘 거래량"
+        return filtered_data.sort_values('today_volume', ascending=False, kind='stable')
+
+@st.cache_data(ttl=60 * 60, max_entries=32, show_spinner=False)
+def df_to_csv_bytes(df):
+    """데이터프레임을 CSV 바이트로 변환합니다."""
+    return df.to_csv(index=False).encode('utf-8')
+
+@st.fragment
+def filter_and_render(volume_data):
+    """필터 옵션과 결과 표시 부분만 다시 실행되도록 분리합니다."""
+    # 필터링 옵션
+    st.subheader("필터 옵션")
+    col1, col2, col3 = st.columns(3)
+
+    with col1:
+        min_volume = st.number_input("최소 거래량", min_value=0, value=1000)
+
+    with col2:
+        min_change_rate = st.number_input("최소 변화율 (%)", min_value=0, value=10)
+
+    with col3:
+        sort_by = st.selectbox(
+            "정렬 기준",
+            options=["거래량 변화율 (절대값)", "거래량 변화율 (양수 우선)", "오늘 거래량"]
+        )
+
+    # 데이터 필터링 및 정렬
+    sorted_data = build_view(volume_data, min_volume, min_change_rate, sort_by)
+
+    # 데이터 표시
+    if not sorted_data.empty:
+        st.subheader("거래량 변화율 상위 코인")
+    
+        # 표 표시 형식 (거래량은 정수, 변화율은 소수점 1자리)
+        column_config = {
+            '오늘 거래량': st.column_config.NumberColumn(format="%d"),
+            '어제 거래량': st.column_config.NumberColumn(format="%d"),
+            '가격변동률 (%)': st.column_config.NumberColumn(format="%.1f"),
+            '거래량 변화율 (%)': st.column_config.NumberColumn(format="%.1f"),
+        }
+    
+        # 탭 생성
+        tab1, tab2 = st.tabs(["차트 보기", "데이터 보기"])
+    
+        with tab1:
+            # 상위 10개 코인 (변화율 기준 정렬)
+            top10 = sorted_data.head(10).nlargest(10, 'abs_volume_change_rate')
+        
+            # 차트 데이터 준비 - 순서대로 정렬해서 바로 표시 (x와 y 자리 바꿈)
+            chart_data = top10.set_index('korean_name')[['volume_change_rate']]
+            chart_data.columns = ['거래량 변화율']
+        
+            # 차트 생성
+            st.write("### 거래량 변화율 상위 10개 코인")
+            st.bar_chart(chart_data)
+        
+            # 추가 정보 제공
+            st.subheader("상위 10개 코인 상세 정보")
+        
+            # 데이터 테이블 준비
+            df_top10 = top10[['korean_name', 'market', 'trade_price', 'signed_change_rate', 'today_volume', 'yesterday_volume', 'volume_change_rate']].copy()
+            df_top10.columns = ['코인명', '마켓', '현재가', '가격변동률 (%)', '오늘 거래량', '어제 거래량', '거래량 변화율 (%)']
+        
+            # 표 떨림 방지를 위해 고정 너비 컨테이너에 표시
+            st.container()
+            st.dataframe(
+                df_top10,
+                use_container_width=True,
+                height=400,  # 높이 고정
+                hide_index=True,  # 인덱스 숨김
+                column_config=column_config  # 형식은 브라우저에서 표시할 때만 적용
+            )
+    
+        with tab2:
+            # 테이블용 데이터프레임 생성
+            # 열 선택 및 이름 변경
+            df = sorted_data[['market', 'korean_name', 'trade_price', 'signed_change_rate', 'today_volume', 'yesterday_volume', 'volume_change_rate']].copy()
+            df.columns = ['마켓', '코인명', '현재가', '가격변동률 (%)', '오늘 거래량', '어제 거래량', '거래량 변화율 (%)']
+        
+            # 기본 데이터프레임 표시 (표 떨림 방지)
+            st.container()
+            st.dataframe(
+                df,
+                use_container_width=True,
+                height=600,
+                hide_index=True,  # 인덱스 숨김
+                column_config=column_config  # 형식은 브라우저에서 표시할 때만 적용
+            )
+        
+            # CSV 다운로드 버튼 (거래량은 기존과 같이 정수로 저장)
+            csv = df_to_csv_bytes(df.astype({'오늘 거래량': int, '어제 거래량': int}))
+            st.download_button(
+                "CSV 다운로드",
+                csv,
+                "coin_volume_data.csv",
+                "text/csv",
+                key='download-csv'
+            )
+    else:
+        st.warning("데이터를 불러올 수 없거나 필터 조건에 맞는 데이터가 없습니다.")
 
 # 앱 메인 부분
 st.title("코인 거래량 변화율 트래커")
@@ -139,116 +355,8 @@ st.text(f"마지막 업데이트: {st.session_state.last_update}")
 # 데이터 가져오기
 volume_data = st.session_state.volume_data
 
-# 필터링 옵션
-st.subheader("필터 옵션")
-col1, col2, col3 = st.columns(3)
-
-with col1:
-    min_volume = st.number_input("최소 거래량", min_value=0, value=1000)
-
-with col2:
-    min_change_rate = st.number_input("최소 변화율 (%)", min_value=0, value=10)
-
-with col3:
-    sort_by = st.selectbox(
-        "정렬 기준",
-        options=["거래량 변화율 (절대값)", "거래량 변화율 (양수 우선)", "오늘 거래량"]
-    )
-
-# 데이터 필터링
-filtered_data = [
-    item for item in volume_data
-    if item['today_volume'] >= min_volume
-    and abs(item['volume_change_rate']) >= min_change_rate
-]
-
-# 정렬 적용
-if sort_by == "거래량 변화율 (절대값)":
-    sorted_data = sorted(filtered_data, key=lambda x: abs(x['volume_change_rate']), reverse=True)
-elif sort_by == "거래량 변화율 (양수 우선)":
-    sorted_data = sorted(filtered_data, key=lambda x: (-1 if x['volume_change_rate'] > 0 else 1, -abs(x['volume_change_rate'])))
-else:  # "오늘 거래량"
-    sorted_data = sorted(filtered_data, key=lambda x: x['today_volume'], reverse=True)
-
-# 데이터 표시
-if sorted_data:
-    st.subheader("거래량 변화율 상위 코인")
-    
-    # 탭 생성
-    tab1, tab2 = st.tabs(["차트 보기", "데이터 보기"])
-    
-    with tab1:
-        # 상위 10개 코인 (변화율 기준 정렬)
-        top10 = sorted(sorted_data[:10], key=lambda x: abs(x['volume_change_rate']), reverse=True)
-        
-        # 차트 데이터 준비 - 순서대로 정렬해서 바로 표시
-        sorted_coins = [item['korean_name'] for item in top10]
-        sorted_values = [item['volume_change_rate'] for item in top10]
-        
-        # 새로운 방식으로 차트 만들기 (x와 y 자리 바꿈)
-        chart_data = pd.DataFrame(sorted_values, index=sorted_coins, columns=['거래량 변화율'])
-        
-        # 차트 생성
-        st.write("### 거래량 변화율 상위 10개 코인")
-        st.bar_chart(chart_data)
-        
-        # 추가 정보 제공
-        st.subheader("상위 10개 코인 상세 정보")
-        
-        # 데이터 테이블 준비
-        df_top10 = pd.DataFrame(top10)
-        df_top10 = df_top10[['korean_name', 'market', 'trade_price', 'signed_change_rate', 'today_volume', 'yesterday_volume', 'volume_change_rate']]
-        df_top10.columns = ['코인명', '마켓', '현재가', '가격변동률 (%)', '오늘 거래량', '어제 거래량', '거래량 변화율 (%)']
-        
-        # 데이터 형식 지정 (소수점 조정)
-        df_top10['가격변동률 (%)'] = df_top10['가격변동률 (%)'].round(1)
-        df_top10['오늘 거래량'] = df_top10['오늘 거래량'].astype(int)
-        df_top10['어제 거래량'] = df_top10['어제 거래량'].astype(int)
-        df_top10['거래량 변화율 (%)'] = df_top10['거래량 변화율 (%)'].round(1)
-        
-        # 표 떨림 방지를 위해 고정 너비 컨테이너에 표시
-        st.container()
-        st.dataframe(
-            df_top10,
-            use_container_width=True,
-            height=400,  # 높이 고정
-            hide_index=True  # 인덱스 숨김
-        )
-    
-    with tab2:
-        # 테이블용 데이터프레임 생성
-        df = pd.DataFrame(sorted_data)
-        
-        # 열 선택 및 이름 변경
-        df = df[['market', 'korean_name', 'trade_price', 'signed_change_rate', 'today_volume', 'yesterday_volume', 'volume_change_rate']]
-        df.columns = ['마켓', '코인명', '현재가', '가격변동률 (%)', '오늘 거래량', '어제 거래량', '거래량 변화율 (%)']
-        
-        # 데이터 형식 지정 (소수점 조정)
-        df['가격변동률 (%)'] = df['가격변동률 (%)'].round(1)
-        df['오늘 거래량'] = df['오늘 거래량'].astype(int)
-        df['어제 거래량'] = df['어제 거래량'].astype(int)
-        df['거래량 변화율 (%)'] = df['거래량 변화율 (%)'].round(1)
-        
-        # 기본 데이터프레임 표시 (표 떨림 방지)
-        st.container()
-        st.dataframe(
-            df,
-            use_container_width=True,
-            height=600,
-            hide_index=True  # 인덱스 숨김
-        )
-        
-        # CSV 다운로드 버튼
-        csv = df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            "CSV 다운로드",
-            csv,
-            "coin_volume_data.csv",
-            "text/csv",
-            key='download-csv'
-        )
-else:
-    st.warning("데이터를 불러올 수 없거나 필터 조건에 맞는 데이터가 없습니다.")
+# 필터링 및 데이터 표시 (위젯을 바꾸면 이 부분만 다시 실행)
+filter_and_render(volume_data)
 
 # 사용 방법 안내
 with st.expander("📚 사용 방법"):